@@ -4,8 +4,9 @@
 # checks ALOV release for completeness by comparing frame counts to vanilla
 # https://github.com/ALotOfVideos/ALOV-scripts
 #
-# requirements: python 3.5, ffprobe (ffmpeg)
+# requirements: python 3.5, ffprobe (ffmpeg), numpy (optional, for --timing), ffmpeg (for --render)
 
+import os
 import os.path
 from os import name as osname
 import pathlib
@@ -14,15 +15,25 @@ import subprocess as sp
 import json
 from datetime import datetime
 import argparse
+import filecmp
 import glob
+import hashlib
 import math
 import re
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from enum import IntEnum
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 quick = False
 intermediate = False
+stream = False
 filetype = ""
+jobs = os.cpu_count() or 1
 
 game: str = None
 folder_mappings = None
@@ -46,6 +57,29 @@ log_verbosity = Verb.ALL
 poplist = []
 unknownlist = []
 
+# content fingerprints keyed by path and stat metadata, and probe results keyed by fingerprint, reused across runs
+probe_cache = None
+probe_cache_path = 'alov_probe_cache.json'
+# fingerprints looked up in this run; only these are saved
+fingerprint_keys = set()
+# bytes hashed from the start and the end of a file for its fingerprint
+fingerprint_size = 64 * 1024
+
+# streaming mode: found DB entries as bitset, detailed records spilled to report file
+found_bits = None
+report = None
+report_path = None
+
+# timing analysis: packets this much smaller than the median packet are considered duplicate frames
+dup_size_factor = 0.05
+# extra share of duplicate frames / seconds frozen compared to vanilla before it counts as stutter
+dup_share_thresh = 0.1
+freeze_thresh = 0.5
+# seconds of context around the segment of each failed timing check
+segment_padding = 1.0
+# seconds from the start of a clip rendered for issues spread over the whole clip
+segment_length = 10.0
+
 ansi_escape = re.compile(r'\x1B[@-_][0-?]*[ -/]*[@-~]')
 file_ext = re.compile(r'\..+$')
 log_newlines = re.compile(r'\n+$')
@@ -169,13 +203,14 @@ def getRelativeDir(p, to=''):
     return str(pathlib.Path(p).relative_to(to))
 
 
-def getBikProperties(f, root=''):
+def getBikProperties(f, root='', header_only=None):
+    header_only = quick if header_only is None else header_only
     if not os.path.isfile(f):
         error(f"file {f} does not exist\n")
         sys.exit(1)
 
     ffmpeg_command = ["ffprobe", "-v", "quiet", "-hide_banner", "-select_streams", "v", "-print_format", "json", "-show_entries", "stream=filename,nb_read_frames,r_frame_rate,width,height,duration_ts", f]
-    if not quick:
+    if not header_only:
         ffmpeg_command.append("-count_frames")
     probe = sp.Popen(ffmpeg_command, stdout=sp.PIPE)
     probe_bik = json.loads(probe.stdout.read())
@@ -191,13 +226,72 @@ def getBikProperties(f, root=''):
         'width': probe_bik.get('width', 0),
         'height': probe_bik.get('height', 0),
         'fps': round(eval(probe_bik.get('r_frame_rate')), 2),
-        'frame_count': int(probe_bik.get('nb_read_frames') if not quick else probe_bik.get('duration_ts')),
+        'frame_count': int(probe_bik.get('nb_read_frames') if not header_only else probe_bik.get('duration_ts')),
         'frame_count_header': int(probe_bik.get('duration_ts'))
         }
 
     return bik
 
 
+def loadProbeCache():
+    global probe_cache
+    global probe_cache_path
+
+    probe_cache = {'fingerprints': dict(), 'probes': dict()}
+    if os.path.isfile(probe_cache_path):
+        with open(probe_cache_path, 'r') as cache_fp:
+            probe_cache.update(json.load(cache_fp))
+
+
+def getFingerprint(f, st=None):
+    # size and hash of the start and end of the file, cached by path and stat metadata
+    global probe_cache
+    global fingerprint_size
+    global fingerprint_keys
+
+    st = os.stat(f) if st is None else st
+    key = f"{os.path.abspath(f)}|{st.st_size}|{st.st_mtime_ns}"
+    fingerprint_keys.add(key)
+    fingerprint = probe_cache['fingerprints'].get(key)
+    if fingerprint is None:
+        h = hashlib.sha1()
+        with open(f, 'rb') as fp:
+            h.update(fp.read(fingerprint_size))
+            if st.st_size > fingerprint_size:
+                fp.seek(max(fingerprint_size, st.st_size - fingerprint_size))
+                h.update(fp.read())
+        fingerprint = f"{st.st_size}-{h.hexdigest()}"
+        probe_cache['fingerprints'][key] = fingerprint
+    return fingerprint
+
+
+def getCachedBikProperties(f, root=''):
+    # probe results are shared by all files with the same contents, e.g. copies of a previous release
+    global probe_cache
+    global quick
+
+    key = f"{getFingerprint(f)}|{'quick' if quick else 'full'}"
+    bik = probe_cache['probes'].get(key)
+    if bik is None:
+        bik = getBikProperties(f, root)
+        if bik.get('defect') is not None:
+            return bik
+        probe_cache['probes'][key] = bik
+    return {**bik, 'name': os.path.basename(f), 'dir': getRelativeDir(os.path.dirname(f), root)}
+
+
+def saveProbeCache():
+    global probe_cache
+    global probe_cache_path
+    global fingerprint_keys
+
+    if probe_cache is not None:
+        # drop fingerprints of files not seen in this run, e.g. of deleted temporary copies
+        fingerprints = {k: v for k, v in probe_cache['fingerprints'].items() if k in fingerprint_keys}
+        with open(probe_cache_path, 'w') as cache_fp:
+            json.dump({**probe_cache, 'fingerprints': fingerprints}, cache_fp, indent=0)
+
+
 def checkHeader(video, check_fstring, header_string="checking header: "):
     global quick
 
@@ -218,6 +312,103 @@ def checkHeader(video, check_fstring, header_string="checking header: "):
     return 0
 
 
+def iterFiles(d, ext):
+    # walks d lazily, sorting only one directory level at a time
+    # matches like glob: hidden files are skipped, extensions are case-insensitive on windows
+    ext = f'.{ext}'
+    for root, dirs, files in os.walk(d):
+        dirs[:] = sorted((i for i in dirs if not i.startswith('.')), key=str.lower)
+        for f in sorted(files, key=str.lower):
+            if f.startswith('.'):
+                continue
+            if f.endswith(ext) or (osname == 'nt' and f.lower().endswith(ext.lower())):
+                yield os.path.join(root, f)
+
+
+def markFound(vanilla, i):
+    global stream
+    global found_bits
+    global poplist
+
+    if stream:
+        found_bits[i >> 3] |= 1 << (i & 7)
+    else:
+        poplist.append(vanilla)
+
+
+def isFound(i):
+    global found_bits
+    return found_bits[i >> 3] >> (i & 7) & 1
+
+
+def markUnknown(entry):
+    global stream
+    global unknownlist
+
+    if stream:
+        spill('unknown', entry)
+    else:
+        unknownlist.append(entry)
+
+
+def spill(kind, record):
+    global report
+    print(json.dumps({'kind': kind, **record}), file=report)
+
+
+def readReport(kind, **match):
+    global report
+    global report_path
+
+    report.flush()
+    with open(report_path, 'r') as rp:
+        for line in rp:
+            r = json.loads(line)
+            if r.get('kind') == kind and all(r.get(k) == v for k, v in match.items()):
+                yield r
+
+
+def resolveFolder(fm, realfolder, name):
+    # some dirs contain single files mapped to various origins
+    # such single file mappings are preferred over the folder mapping
+    folder = f"{realfolder}/{name}"  # TODO Windows #15 - needs literal / as database uses unix style separator
+    folder = fm.get(folder)
+    if folder is None:
+        folder = fm.get(realfolder)
+    return folder
+
+
+def getInstallLocation(f, root, fm):
+    # returns name and dir of f in the release, and name and dir it installs to as in the database
+    global intermediate
+
+    realname = os.path.basename(f)
+    name = realname
+
+    # replace intermediate file extension with vanilla extension to match library
+    if intermediate:
+        name = file_ext.sub('.bik', realname)
+
+    realfolder = getRelativeDir(os.path.dirname(f), root)
+    if osname == 'nt':  # TODO Windows #15
+        realfolder = realfolder.replace('\\', '/')
+
+    return realname, name, realfolder, resolveFolder(fm, realfolder, name)
+
+
+def findVanilla(db, name, folder=None, ignore_case=False):
+    # returns index and entry of the vanilla file, or (None, {}) if not in db
+    if ignore_case:
+        name = name.lower()
+    for i, v in enumerate(db):
+        vname = v.get('name')
+        if ignore_case:
+            vname = vname.lower()
+        if vname == name and (folder is None or v.get('dir') == folder):
+            return i, v
+    return None, dict()
+
+
 def index(d):
     if not os.path.isdir(d):
         error(f"directory {d} does not exist\n")
@@ -258,9 +449,6 @@ def index(d):
 
 def compare(f, root=''):
     global quick
-    global poplist
-    global unknownlist
-    global intermediate
 
     if not os.path.isfile(f):
         error(f"file {f} does not exist\n")
@@ -280,40 +468,14 @@ def compare(f, root=''):
     if bik.get('defect') is not None:
         return bik, None
 
-    realname = bik.get('name')
-    name = realname
-
-    # replace intermediate file extension with vanilla extension to match library
-    if intermediate:
-        ext = '.bik'
-        name = file_ext.sub(ext, realname)
-
-    realfolder = bik.get('dir')
-    if osname == 'nt':  # TODO Windows #15
-        realfolder = realfolder.replace('\\', '/')
-
-    # some dirs contain single files mapped to various origins
-    # such single file mappings are preferred over the folder mapping
-    folder = f"{realfolder}/{name}"  # TODO Windows #15 - needs literal / as database uses unix style separator
-    folder = fm.get(folder)
-    if folder is None:
-        folder = fm.get(realfolder)
+    realname, name, realfolder, folder = getInstallLocation(f, root, fm)
 
     log(f"checking {os.path.join(bik.get('dir'), realname)}\n", level=Verb.WARN)
 
-    vanilla = dict()
-    if root == '':
-        # comparing a bik manually(?): best effort search
-        for v in db:
-            if v.get('name') == name:
-                vanilla = v
-                break
-    else:
-        # checking a release: we know the corresponding folder
-        for v in db:
-            if v.get('dir') == folder and v.get('name') == name:
-                vanilla = v
-                break
+    # comparing a bik manually(?): best effort search
+    # checking a release: we know the corresponding folder
+    search_folder = None if root == '' else folder
+    vanilla_idx, vanilla = findVanilla(db, name, search_folder)
 
     log(f"{'ALOV file:':13s} {bik.get('dir')}/{name}\n", level=Verb.DEBUG)  # TODO Windows #15
     log(f"{'resolved dir:':13s} {folder}\n", level=Verb.DEBUG)
@@ -333,16 +495,7 @@ def compare(f, root=''):
     if vanilla.get('name') is None:
         log(check_fstring.format(exist_string), level=Verb.WARN)
         # search case-insensitive
-        if root == '':
-            for v in db:
-                if v.get('name').lower() == name.lower():
-                    vanilla = v
-                    break
-        else:
-            for v in db:
-                if v.get('dir') == folder and v.get('name').lower() == name.lower():
-                    vanilla = v
-                    break
+        vanilla_idx, vanilla = findVanilla(db, name, search_folder, ignore_case=True)
         if vanilla.get('name') is None:
             error("WARNING: cutscene not found in vanilla database\n")
             return errors, None
@@ -350,14 +503,13 @@ def compare(f, root=''):
             error("WARNING: cutscene uses wrong capitalization\n")
             log(capitalization_fstring.format("vanilla:", vanilla.get('name')), level=Verb.WARN)
             log(capitalization_fstring.format("found:", name), level=Verb.WARN)
-            unknownlist.append({'name': name, 'dir': folder})
+            markUnknown({'name': name, 'dir': folder})
             errors['missing'] -= 1
         errors['db'] += 1
     else:
         log(check_fstring.format(exist_string))
         log_ok("OK: cutscene found in database\n")
-    if vanilla is not None:
-        poplist.append(vanilla)
+    markFound(vanilla, vanilla_idx)
 
     # check resolution
     rAlias, rLiteral = getResolutionAlias(bik)
@@ -515,6 +667,8 @@ def check(d):
     global poplist
     global unknownlist
     global filetype
+    global stream
+    global found_bits
 
     if not os.path.isdir(d):
         error(f"directory {d} does not exist\n")
@@ -534,24 +688,36 @@ def check(d):
     count = 0
     errors = {'db': 0, 'res': 0, 'frame': 0, 'missing': 0, 'header': 0}
 
-    biks = sorted(glob.glob(os.path.join(d, '**', f'*.{filetype}'), recursive=True), key=str.lower)
+    if stream:
+        # reduce results on the fly: only counters and a bitset stay in memory
+        biks = iterFiles(d, filetype)
+        found_bits = bytearray((total + 7) // 8)
+    else:
+        biks = sorted(glob.glob(os.path.join(d, '**', f'*.{filetype}'), recursive=True), key=str.lower)
 
     resolutions = dict()
+    resolutionsCounter = Counter()
     for bik in biks:
         count += 1
         log(log_string.format(count, total), level=Verb.WARN)
         e, r = compare(bik, d)
         errors = dict(Counter(errors) + Counter(e))
         if r is not None:
-            if resolutions.get(r['resolution']) is None:
-                resolutions[r['resolution']] = list()
-            resolutions[r['resolution']].append(r['bik'])
+            resolutionsCounter[r['resolution']] += 1
+            if stream:
+                spill('result', {'resolution': r['resolution'], **r['bik'], 'errors': e})
+            else:
+                if resolutions.get(r['resolution']) is None:
+                    resolutions[r['resolution']] = list()
+                resolutions[r['resolution']].append(r['bik'])
+        elif stream:
+            # unreadable or not in database
+            spill('error', {'name': os.path.basename(bik), 'dir': getRelativeDir(os.path.dirname(bik), d), 'errors': e})
 
 
     missing_fstring = "{:>18s}\n"
 
     log("\n", level=Verb.WARN)
-    resolutionsCounter = Counter({k: len(v) for k,v in resolutions.items()})
     mainResolution = resolutionsCounter.most_common(1)[0]
     if resolutionIsOK(mainResolution[0]):
         log_ok(f"Detected resolution of this package: {mainResolution[0]} (x{mainResolution[1]})\n")
@@ -559,19 +725,22 @@ def check(d):
         error(f"ERROR: Detected resolution of this package: {mainResolution[0]} (x{mainResolution[1]})\n")
     else:
         warning(f"WARNING: Detected resolution of this package: {mainResolution[0]} (x{mainResolution[1]})\n")
-    if len(resolutions) > 1:
+    if len(resolutionsCounter) > 1:
         del resolutionsCounter[mainResolution[0]]
         # TODO search and delete explicitly allowed resolutions from devitation.json
         error(missing_fstring.format("inconsistencies:"))
         for k, v in resolutionsCounter.items():
             error(f"{k:>17s}: {v}\n")
-            printTree(resolutions[k])
+            if stream:
+                printTree(readReport('result', resolution=k))
+            else:
+                printTree(resolutions[k])
         errors['res_glo'] = sum(resolutionsCounter.values())
 
-    missing = db
-    for i in poplist:
-        if i in missing:
-            missing.remove(i)
+    if stream:
+        missing = [v for i, v in enumerate(db) if not isFound(i)]
+    else:
+        missing = [v for v in db if v not in poplist]
 
     log("\n", level=Verb.WARN)
     if count != total or errors.get('db', 0) != 0:
@@ -586,7 +755,7 @@ def check(d):
             error(mismatch_fstring.format("unexpected:", errors.get('db', 0)))
             error("\n")
             error(missing_fstring.format("unexpected files:"))
-            printTree(unknownlist)
+            printTree(readReport('unknown') if stream else unknownlist)
 
         if len(missing) > 0:
             error(missing_fstring.format("missing files:"))
@@ -600,6 +769,490 @@ def check(d):
     return errors
 
 
+def iterPairs(vanilla_root, d):
+    # yields each release file with the path and db entry of its vanilla counterpart (None if not in db)
+    global filetype
+
+    db = getDB()
+    fm = getMappings()
+    for f in iterFiles(d, filetype):
+        _, name, _, folder = getInstallLocation(f, d, fm)
+        _, vanilla = findVanilla(db, name, folder)
+        if vanilla.get('name') is None:
+            _, vanilla = findVanilla(db, name, folder, ignore_case=True)
+        if vanilla.get('name') is None:
+            yield f, None, None
+        else:
+            yield f, os.path.join(vanilla_root, *vanilla.get('dir').split('/'), vanilla.get('name')), vanilla
+
+
+def getPacketTimes(f):
+    # single demux pass without decoding: presentation timestamps and sizes of all video packets
+    ffmpeg_command = ["ffprobe", "-v", "quiet", "-hide_banner", "-select_streams", "v:0", "-show_entries", "packet=pts_time,size", "-print_format", "csv=p=0", f]
+    probe = sp.run(ffmpeg_command, stdout=sp.PIPE)
+    packets = probe.stdout.decode().strip().replace('N/A', 'nan').replace('\r', '').replace('\n', ',')
+    try:
+        packets = np.fromstring(packets, sep=',').reshape(-1, 2)
+    except ValueError:
+        return None, None
+    packets = packets[~np.isnan(packets[:, 0])]
+    order = np.argsort(packets[:, 0], kind='stable')
+    return packets[order, 0], packets[order, 1]
+
+
+def getTiming(f):
+    global dup_size_factor
+
+    pts, sizes = getPacketTimes(f)
+    if pts is None or pts.size == 0:
+        return {'defect': 1}
+    if pts.size == 1:
+        return {'frames': 1}
+
+    deltas = np.diff(pts)
+    frame_time = float(np.median(deltas))
+    irregular = np.flatnonzero(np.abs(deltas - frame_time) > 0.5 * frame_time)
+
+    # runs of duplicate frames: encoders store repeated frames as tiny packets
+    dup = sizes < dup_size_factor * np.median(sizes)
+    edges = np.diff(np.concatenate(([0], dup.astype(np.int8), [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_lengths = np.flatnonzero(edges == -1) - run_starts
+
+    longest_freeze = 0.0
+    freeze = None
+    if run_lengths.size > 0:
+        i = int(np.argmax(run_lengths))
+        longest_freeze = float(run_lengths[i]) * frame_time
+        start = float(pts[run_starts[i]])
+        freeze = (start, start + longest_freeze)
+    gap = None
+    if irregular.size > 0:
+        j = int(irregular[np.argmax(np.abs(deltas[irregular] - frame_time))])
+        gap = (float(pts[j]), float(pts[j + 1]))
+
+    return {
+        'frames': int(pts.size),
+        'duration': float(pts[-1] - pts[0]) + frame_time,
+        'frame_time': frame_time,
+        'irregular': int(irregular.size),
+        'dup_share': float(np.count_nonzero(dup)) / pts.size,
+        'longest_freeze': longest_freeze,
+        'freeze': freeze,
+        'gap': gap
+        }
+
+
+def timingPair(pair):
+    f, vanilla_path, _ = pair
+    if vanilla_path is None or not os.path.isfile(vanilla_path):
+        return f, vanilla_path, None, None
+    return f, vanilla_path, getTiming(vanilla_path), getTiming(f)
+
+
+def compareTiming(v, a):
+    # returns errors and the segments (start, end) of the failed checks
+    global dup_share_thresh
+    global freeze_thresh
+    global segment_length
+
+    errors = {'timing': 0}
+    segments = list()
+    check_fstring = "{:<25s}"
+    duration_string = "1. checking duration:"
+    cadence_string = "2. checking cadence:"
+    dup_string = "3. checking duplicates:"
+    duration_fstring = "{:>10s} {:.3f} s ({:d} frames)\n"
+
+    if a.get('frames') == 1:
+        log(check_fstring.format(duration_string), level=Verb.WARN)
+        log_info("OK: video removed (startup logo?)\n", level=Verb.WARN)
+        return errors, segments
+
+    # allow one vanilla frame of deviation
+    ratio = a.get('duration') / v.get('duration')
+    tolerance = v.get('frame_time') / v.get('duration')
+    if abs(ratio - 1) <= tolerance:
+        log(check_fstring.format(duration_string))
+        log_ok(f"OK: durations match ({v.get('duration'):.3f} s)\n")
+    elif ratio > 1 and abs(ratio - round(ratio)) <= tolerance * round(ratio):
+        log(check_fstring.format(duration_string), level=Verb.INFO)
+        log_info("OK: extended/looped clip\n")
+        log(duration_fstring.format("vanilla:", v.get('duration'), v.get('frames')), level=Verb.INFO)
+        log(duration_fstring.format("found:", a.get('duration'), a.get('frames')), level=Verb.INFO)
+    else:
+        log(check_fstring.format(duration_string), level=Verb.WARN)
+        if ratio < 1:
+            error(f"WARNING: sped up (x{1 / ratio:.3f})\n")
+        else:
+            error(f"WARNING: slowed down (x{ratio:.3f})\n")
+        log(duration_fstring.format("vanilla:", v.get('duration'), v.get('frames')), level=Verb.WARN)
+        log(duration_fstring.format("found:", a.get('duration'), a.get('frames')), level=Verb.WARN)
+        errors['timing'] += 1
+        # drift affects the whole clip
+        segments.append((0.0, a.get('duration')))
+
+    if a.get('irregular') <= v.get('irregular'):
+        log(check_fstring.format(cadence_string))
+        log_ok(f"OK: constant frame time ({a.get('frame_time') * 1000:.2f} ms)\n")
+    else:
+        log(check_fstring.format(cadence_string), level=Verb.WARN)
+        error(f"WARNING: irregular frame cadence ({a.get('irregular')} gaps, vanilla {v.get('irregular')})\n")
+        errors['timing'] += 1
+        segments.append(a.get('gap'))
+
+    if a.get('longest_freeze') - v.get('longest_freeze') > freeze_thresh:
+        log(check_fstring.format(dup_string), level=Verb.WARN)
+        error(f"WARNING: stutter: frozen for {a.get('longest_freeze'):.2f} s at {a.get('freeze')[0]:.2f} s (vanilla {v.get('longest_freeze'):.2f} s)\n")
+        errors['timing'] += 1
+        segments.append(a.get('freeze'))
+    elif a.get('dup_share') - v.get('dup_share') > dup_share_thresh:
+        log(check_fstring.format(dup_string), level=Verb.WARN)
+        error(f"WARNING: {a.get('dup_share'):.0%} duplicate frames (vanilla {v.get('dup_share'):.0%}): interpolated by frame doubling?\n")
+        errors['timing'] += 1
+        # spread over the whole clip: its start is representative
+        segments.append((0.0, min(a.get('duration'), segment_length)))
+    else:
+        log(check_fstring.format(dup_string))
+        log_ok("OK: no additional duplicate frames\n")
+
+    return errors, segments
+
+
+def timing(vanilla_root, d, segments_path):
+    global jobs
+    global segment_padding
+
+    if np is None:
+        error("timing analysis requires numpy: pip install numpy\n")
+        sys.exit(1)
+    for p in (vanilla_root, d):
+        if not os.path.isdir(p):
+            error(f"directory {p} does not exist\n")
+            sys.exit(1)
+
+    log(f"analysing timing of ALOV release at {d} against vanilla at {vanilla_root}\n", level=Verb.WARN)
+    getMappings()
+
+    db = getDB()
+    if db is None:
+        error("database missing\n")
+        sys.exit(1)
+
+    total = len(db)
+    mag = math.floor(math.log10(total)) + 1
+    log_string = f"({{:0{str(mag)}d}}/{{:0{str(mag)}d}}) "  # TODO interpolate strings properly
+    count = 0
+    errors = {'timing': 0}
+    segments = dict()
+
+    # probing runs in parallel, results are logged in order
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for f, vanilla_path, v, a in executor.map(timingPair, iterPairs(vanilla_root, d)):
+            count += 1
+            log(log_string.format(count, total), level=Verb.WARN)
+            log(f"checking {getRelativeDir(f, d)}\n", level=Verb.WARN)
+            if vanilla_path is None:
+                error("WARNING: cutscene not found in vanilla database\n")
+                errors = dict(Counter(errors) + Counter({'db': 1}))
+                continue
+            if v is None:
+                error(f"WARNING: vanilla file {vanilla_path} does not exist\n")
+                errors = dict(Counter(errors) + Counter({'missing': 1}))
+                continue
+            if v.get('defect') is not None or v.get('frames') == 1:
+                error(f"WARNING: vanilla file {vanilla_path} has no usable timestamps\n")
+                continue
+            if a.get('defect') is not None:
+                error(f"{f} could not be read: verify whether the file is intact\n")
+                errors = dict(Counter(errors) + Counter(a))
+                continue
+
+            e, failed = compareTiming(v, a)
+            errors = dict(Counter(errors) + Counter(e))
+            if len(failed) > 0:
+                segments[pathlib.Path(f).relative_to(d).as_posix()] = [[round(max(0, start - segment_padding), 3), round(min(a.get('duration'), end + segment_padding), 3)] for start, end in failed]
+
+    if len(segments) > 0:
+        with open(segments_path, 'w') as out:
+            json.dump(segments, out, indent=4)
+        log("\n", level=Verb.WARN)
+        log(f"saved segments of failed checks to {segments_path}\n", level=Verb.WARN)
+
+    return errors
+
+
+def buildFilter(layout, width, height, fps):
+    # input 0 is vanilla, input 1 is ALOV; both are brought to the same size and frame rate
+    # even dimensions for yuv420p
+    width -= width % 2
+    height -= height % 2
+    common = f"fps={fps},scale={width}:{height},setsar=1,format=yuv420p"
+    graph = f"[0:v]{common}[v];[1:v]{common}[a];"
+    if layout == 'split':
+        # vanilla top, ALOV bottom
+        half = height // 4 * 2
+        graph += f"[v]crop={width}:{half}:0:0[t];[a]crop={width}:{height - half}:0:{half}[b];[t][b]vstack[out]"
+    elif layout == 'wipe':
+        # vanilla left, ALOV right
+        half = width // 4 * 2
+        graph += f"[v]crop={half}:{height}:0:0[l];[a]crop={width - half}:{height}:{half}:0[r];[l][r]hstack[out]"
+    elif layout == 'diff':
+        graph += "[v][a]blend=all_mode=difference[out]"
+    return graph
+
+
+def renderPair(job):
+    f, d, vanilla_path, vanilla, ranges, layout, outdir = job
+
+    # rendering only needs the header properties
+    bik = getBikProperties(f, d, header_only=True)
+    if bik.get('defect') is not None:
+        return f, [(None, 1)]
+
+    # render at the ALOV resolution and the higher of both frame rates
+    fps = max(bik.get('fps'), vanilla.get('fps'))
+    graph = buildFilter(layout, bik.get('width'), bik.get('height'), fps)
+
+    out_base = os.path.join(outdir, bik.get('dir'), file_ext.sub('', bik.get('name')))
+    os.makedirs(os.path.dirname(out_base), exist_ok=True)
+
+    results = list()
+    for r in ranges:
+        ffmpeg_command = ["ffmpeg", "-nostdin", "-y", "-v", "error"]
+        out = f"{out_base}_{layout}"
+        for path in (vanilla_path, f):
+            if r is not None:
+                ffmpeg_command += ["-ss", str(r[0]), "-t", str(r[1] - r[0])]
+            ffmpeg_command += ["-i", path]
+        if r is not None:
+            out = f"{out}_{r[0]:g}-{r[1]:g}"
+        out = f"{out}.mp4"
+        ffmpeg_command += ["-filter_complex", graph, "-map", "[out]", out]
+        results.append((out, sp.run(ffmpeg_command).returncode))
+    return f, results
+
+
+def render(vanilla_root, d, layout, outdir, segments_path=None, time_range=None):
+    global jobs
+
+    for p in (vanilla_root, d):
+        if not os.path.isdir(p):
+            error(f"directory {p} does not exist\n")
+            sys.exit(1)
+
+    segments = None
+    if segments_path is not None:
+        if not os.path.isfile(segments_path):
+            error(f"segments file {segments_path} does not exist\n")
+            sys.exit(1)
+        with open(segments_path, 'r') as seg_fp:
+            segments = json.load(seg_fp)
+
+    log(f"rendering {layout} comparisons of ALOV release at {d} and vanilla at {vanilla_root} to {outdir}\n", level=Verb.WARN)
+    getMappings()
+
+    if getDB() is None:
+        error("database missing\n")
+        sys.exit(1)
+
+    errors = Counter()
+    renderJobs = list()
+    for f, vanilla_path, vanilla in iterPairs(vanilla_root, d):
+        rel = pathlib.Path(f).relative_to(d).as_posix()
+        if segments is not None:
+            if rel not in segments:
+                continue
+            ranges = segments.get(rel)
+        else:
+            ranges = [time_range]
+
+        if vanilla_path is None:
+            error(f"WARNING: {rel} not found in vanilla database\n")
+            errors['db'] += 1
+        elif not os.path.isfile(vanilla_path):
+            error(f"WARNING: vanilla file {vanilla_path} does not exist\n")
+            errors['missing'] += 1
+        else:
+            renderJobs.append((f, d, vanilla_path, vanilla, ranges, layout, outdir))
+
+    total = len(renderJobs)
+    if total == 0:
+        log("nothing to render\n", level=Verb.WARN)
+        return dict(errors)
+    mag = math.floor(math.log10(total)) + 1
+    log_string = f"({{:0{str(mag)}d}}/{{:0{str(mag)}d}}) "  # TODO interpolate strings properly
+    count = 0
+
+    # each worker probes and renders one pair, results are logged in order
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for f, results in executor.map(renderPair, renderJobs):
+            count += 1
+            log(log_string.format(count, total), level=Verb.WARN)
+            log(f"rendering {getRelativeDir(f, d)}\n", level=Verb.WARN)
+            for out, returncode in results:
+                if out is None:
+                    errors['defect'] += 1
+                elif returncode != 0:
+                    error(f"ERROR: ffmpeg failed to render {out}\n")
+                    errors['render'] += 1
+                else:
+                    log_ok(f"OK: {out}\n")
+
+    return dict(errors)
+
+
+def getReleaseFiles(d):
+    # maps dir and name of every file in release d to its path, stat and install location (via folder mappings)
+    global filetype
+
+    fm = getMappings()
+    files = dict()
+    for f in iterFiles(d, filetype):
+        realname, name, realfolder, folder = getInstallLocation(f, d, fm)
+        files[(realfolder, realname)] = (f, os.stat(f), (folder or realfolder, name))
+    return files
+
+
+def pairReleaseFiles(old_files, new_files):
+    # pairs files by their dir in the release; files that were moved or renamed are paired by install
+    # location, but only if exactly one old and one new file install there (e.g. not main and optional variants)
+    pairs = [(old_files.get(key), new) for key, new in new_files.items()]
+    unpaired_old = [old for key, old in old_files.items() if key not in new_files]
+
+    by_location = dict()
+    for old in unpaired_old:
+        by_location.setdefault(old[2], [list(), list()])[0].append(old)
+    for i, (old, new) in enumerate(pairs):
+        if old is None and new[2] in by_location:
+            by_location[new[2]][1].append(i)
+
+    for olds, indices in by_location.values():
+        if len(olds) == 1 and len(indices) == 1:
+            pairs[indices[0]] = (olds[0], pairs[indices[0]][1])
+            unpaired_old.remove(olds[0])
+
+    return pairs, unpaired_old
+
+
+def isUnchanged(old, new, full_compare=False):
+    # same size and fingerprint; only compared byte by byte if requested, never decoded
+    f_old, st_old = old
+    f_new, st_new = new
+    if st_old.st_size != st_new.st_size:
+        return False
+    if getFingerprint(f_old, st_old) != getFingerprint(f_new, st_new):
+        return False
+    return not full_compare or filecmp.cmp(f_old, f_new, shallow=False)
+
+
+def probePair(job):
+    f_old, old_root, f_new, new_root = job
+    old = None if f_old is None else getCachedBikProperties(f_old, old_root)
+    return f_new, old, getCachedBikProperties(f_new, new_root)
+
+
+def getChanges(old, new):
+    change = {
+        'name': new.get('name'),
+        'dir': new.get('dir'),
+        'old_dir': old.get('dir'),
+        'old': {k: old.get(k) for k in ('width', 'height', 'fps', 'frame_count')},
+        'new': {k: new.get(k) for k in ('width', 'height', 'fps', 'frame_count')}
+        }
+    if not isRes(new, old.get('width'), old.get('height')):
+        change['resolution'] = [getResolutionAlias(old)[0], getResolutionAlias(new)[0]]
+    if old.get('fps') != new.get('fps'):
+        change['fps'] = [old.get('fps'), new.get('fps')]
+    if old.get('frame_count') != new.get('frame_count'):
+        change['frame_count_delta'] = new.get('frame_count') - old.get('frame_count')
+    return change
+
+
+def diff(old_root, new_root, outfile, full_compare=False):
+    global jobs
+
+    for p in (old_root, new_root):
+        if not os.path.isdir(p):
+            error(f"directory {p} does not exist\n")
+            sys.exit(1)
+
+    log(f"comparing ALOV release at {new_root} to previous release at {old_root}\n", level=Verb.WARN)
+    if getMappings() is None:
+        error("folder mappings missing\n")
+        sys.exit(1)
+
+    old_files = getReleaseFiles(old_root)
+    new_files = getReleaseFiles(new_root)
+
+    loadProbeCache()
+    try:
+        changes = diffReleases(old_root, old_files, new_root, new_files, full_compare)
+    finally:
+        saveProbeCache()
+
+    if len(changes['removed']) > 0:
+        error(f"{'removed:':>9s}\n")
+        printTree(changes['removed'])
+
+    with open(outfile, 'w') as out:
+        json.dump(changes, out, indent=4)
+
+    log("\n", level=Verb.WARN)
+    log(f"{len(changes['added'])} added, {len(changes['removed'])} removed, {len(changes['changed'])} changed, {len(changes['defect'])} broken, {changes['unchanged']} unchanged\n", level=Verb.WARN)
+    log(f"saved change list to {outfile}\n", level=Verb.WARN)
+
+
+def diffReleases(old_root, old_files, new_root, new_files, full_compare=False):
+    global jobs
+
+    pairs, unpaired_old = pairReleaseFiles(old_files, new_files)
+
+    # only added and changed files get probed
+    probeJobs = list()
+    unchanged = 0
+    for old, new in pairs:
+        if old is None:
+            probeJobs.append((None, old_root, new[0], new_root))
+        elif isUnchanged(old[:2], new[:2], full_compare):
+            unchanged += 1
+        else:
+            probeJobs.append((old[0], old_root, new[0], new_root))
+    removed = [{'name': os.path.basename(old[0]), 'dir': getRelativeDir(os.path.dirname(old[0]), old_root)}
+               for old in unpaired_old]
+
+    log(f"{unchanged} unchanged, probing {len(probeJobs)} added or changed files\n\n", level=Verb.WARN)
+
+    changes = {'added': list(), 'removed': sorted(removed, key=lambda i: (i.get('dir').lower(), i.get('name').lower())), 'changed': list(), 'defect': list(), 'unchanged': unchanged}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for f, old, new in executor.map(probePair, probeJobs):
+            broken = [side for side, bik in (('old', old), ('new', new)) if bik is not None and bik.get('defect') is not None]
+            if len(broken) > 0:
+                defect = {'name': os.path.basename(f), 'dir': getRelativeDir(os.path.dirname(f), new_root), 'unreadable': broken}
+                changes['defect'].append(defect)
+                error(f"{'broken:':>9s} {defect.get('dir')}/{defect.get('name')} ({' and '.join(broken)} file unreadable)\n")
+                continue
+            if old is None:
+                changes['added'].append(new)
+                log_info(f"{'added:':>9s} {new.get('dir')}/{new.get('name')} ({getResolutionAlias(new)[0]}, {new.get('fps'):.2f} FPS, {new.get('frame_count')} frames)\n")
+                continue
+
+            change = getChanges(old, new)
+            changes['changed'].append(change)
+            details = list()
+            if change.get('resolution') is not None:
+                details.append(" -> ".join(change.get('resolution')))
+            if change.get('fps') is not None:
+                details.append(f"{change.get('fps')[0]:.2f} -> {change.get('fps')[1]:.2f} FPS")
+            if change.get('frame_count_delta') is not None:
+                details.append(f"{change.get('frame_count_delta'):+d} frames")
+            if len(details) == 0:
+                details.append("re-encoded")
+            log(f"{'changed:':>9s} {new.get('dir')}/{new.get('name')}: {', '.join(details)}\n", level=Verb.INFO)
+
+    return changes
+
+
 def init_parser():
     global verbosity
     global log_verbosity
@@ -611,9 +1264,19 @@ def init_parser():
     actiongroup.add_argument('-i', '--index', nargs=1, metavar='PATH', help="gets all bik files inside (sub)directory PATH and outputs a json file with info of all biks")
     actiongroup.add_argument('--compare', nargs=2, metavar=('GAME', 'BIK'), help="compares the supplied BIK to vanilla properties stored in database of GAME (ME1|ME2|ME3)")
     actiongroup.add_argument('-c', '--check', nargs=2, metavar=('GAME', 'PATH'), help="checks all (supported) biks in PATH against the database of given GAME (ME1|ME2|ME3)")
+    actiongroup.add_argument('-d', '--diff', nargs=3, metavar=('GAME', 'OLD', 'NEW'), help="lists files added, removed and re-encoded in ALOV release NEW since release OLD of given GAME (ME1|ME2|ME3)")
+    actiongroup.add_argument('-r', '--render', nargs=3, metavar=('GAME', 'VANILLA', 'PATH'), help="renders side-by-side comparison clips of all biks in PATH and their counterparts in the vanilla game installed at VANILLA (requires ffmpeg)")
+    actiongroup.add_argument('-t', '--timing', nargs=3, metavar=('GAME', 'VANILLA', 'PATH'), help="compares duration, frame cadence and duplicate frames of all biks in PATH to the vanilla game installed at VANILLA (requires numpy)")
 
     parser.add_argument('--quick', '--fast', action='store_const', const=True, default=False, help='only read bik header instead of actually counting frames')
     parser.add_argument('--intermediate', '--prores', action='store_const', const=True, default=False, help='check using Apple ProRes .mov intermediate files instead of release biks')
+    parser.add_argument('--layout', choices=('split', 'wipe', 'diff'), default='split', help="--render layout: vanilla top/ALOV bottom (split), vanilla left/ALOV right (wipe) or difference of both (diff) (default split)")
+    parser.add_argument('--segments', metavar='FILE', help="--render only the files and time ranges listed in FILE (as saved by --timing)")
+    parser.add_argument('--range', nargs=2, type=float, metavar=('START', 'END'), help="--render only the time range from START to END seconds")
+    parser.add_argument('-o', '--output-dir', default='comparisons', help="directory to save --render clips to (default comparisons)")
+    parser.add_argument('--full-compare', action='store_const', const=True, default=False, help="--diff: compare files with matching fingerprints byte by byte")
+    parser.add_argument('-j', '--jobs', type=int, default=jobs, help=f"number of files to analyse in parallel (default {jobs})")
+    parser.add_argument('--stream', action='store_const', const=True, default=False, help='check with bounded memory: aggregate results on the fly and spill detailed records to a report file')
 
     verbositygroup = parser.add_mutually_exclusive_group()
     verbositygroup.add_argument("-v", "--verbosity", action="count", default=verbosity.value, help=f"increase output (stdout) verbosity (default {verbosity.value}={verbosity.name})")
@@ -630,6 +1293,8 @@ def init_parser():
 def main():
     global quick
     global intermediate
+    global stream
+    global jobs
     global filetype
     global game
     global resolutions
@@ -638,23 +1303,35 @@ def main():
     global log_to_file
     global logfile
     global log_verbosity
+    global report
+    global report_path
 
     parser = init_parser()
     args = parser.parse_args()
 
-    if args.compare is not None and args.compare[0] not in ('ME1', 'ME2', 'ME3'):
-        error(f"wrong value for GAME: {args.compare[0]}. Must be either ME1, ME2 or ME3.\n")
-        exit(1)
-    elif args.compare is not None:
-        game = args.compare[0]
-    if args.check is not None and args.check[0] not in ('ME1', 'ME2', 'ME3'):
-        error(f"wrong value for GAME: {args.check[0]}. Must be either ME1, ME2 or ME3.\n")
+    for action in (args.compare, args.check, args.timing, args.render, args.diff):
+        if action is not None and action[0] not in ('ME1', 'ME2', 'ME3'):
+            error(f"wrong value for GAME: {action[0]}. Must be either ME1, ME2 or ME3.\n")
+            exit(1)
+        elif action is not None:
+            game = action[0]
+
+    if args.stream and args.check is None:
+        error("--stream can only be used with --check.\n")
         exit(1)
-    elif args.check is not None:
-        game = args.check[0]
+
+    if args.range is not None:
+        if args.range[0] < 0 or args.range[1] <= args.range[0]:
+            error(f"wrong value for --range: {args.range[0]:g} {args.range[1]:g}. START must not be negative and END must be after START.\n")
+            exit(1)
+        if args.segments is not None:
+            error("--range and --segments cannot be used together.\n")
+            exit(1)
 
     quick = args.quick
     intermediate = args.intermediate
+    stream = args.stream
+    jobs = max(1, args.jobs)
     filetype = 'bik'
     if intermediate:
         filetype = 'mov'
@@ -663,21 +1340,27 @@ def main():
     verbosity = verbosity if args.quiet is None else args.quiet
     verbosity = verbosity if args.debug is None else args.debug
 
+    run_suffix = ''
+    if game is not None:
+        run_suffix = f'{run_suffix}_{game}'
+    if intermediate:
+        run_suffix = f'{run_suffix}_prores'
+    if quick:
+        run_suffix = f'{run_suffix}_quick'
+    run_suffix = f'{run_suffix}_{datetime.now().strftime("%y%m%dT%H%M")}'
+
     log_to_file = args.no_log
     if log_to_file:
-        log_path = ''
-        if game is not None:
-            log_path = f'{log_path}_{game}'
-        if intermediate:
-            log_path = f'{log_path}_prores'
-        if quick:
-            log_path = f'{log_path}_quick'
-        log_path = f'{log_path}_{datetime.now().strftime("%y%m%dT%H%M")}'
-        log_path = f'alov_sanity_checker{log_path}.log'
+        log_path = f'alov_sanity_checker{run_suffix}.log'
 
         logfile = open(log_path, 'w')
         log("opened log file %s\n\n" % log_path, level=Verb.WARN)
 
+    if stream:
+        report_path = f'alov_sanity_checker{run_suffix}_report.jsonl'
+        report = open(report_path, 'w')
+        log("opened report file %s\n\n" % report_path, level=Verb.WARN)
+
     log_verbosity = args.log_verbosity
     log_verbosity = log_verbosity if args.error_log is None else args.error_log
     log_verbosity = log_verbosity if args.short_log is None else args.short_log
@@ -698,11 +1381,17 @@ def main():
         print(bik)
     elif args.index is not None:
         index(args.index[0])
+    elif args.diff is not None:
+        diff(args.diff[1], args.diff[2], f'alov_diff{run_suffix}.json', args.full_compare)
     else:
         if args.compare is not None:
             errors, _ = compare(args.compare[1])
         elif args.check is not None:
             errors = check(args.check[1])
+        elif args.timing is not None:
+            errors = timing(args.timing[1], args.timing[2], f'alov_segments{run_suffix}.json')
+        elif args.render is not None:
+            errors = render(args.render[1], args.render[2], args.layout, args.output_dir, args.segments, args.range)
 
         log("\n", level=Verb.WARN)
         errors['total'] = sum(errors.values())
@@ -715,11 +1404,19 @@ def main():
             error(errors_string.format("Inconsistent res", errors.get('res_glo', 0)))
             error(errors_string.format("Frame count/FPS", errors.get('frame', 0)))
             error(errors_string.format("Missing files", errors.get('missing', 0)))
-            if not quick:
+            if args.timing is not None:
+                error(errors_string.format("Timing", errors.get('timing', 0)))
+            elif args.render is not None:
+                error(errors_string.format("Render failed", errors.get('render', 0)))
+            elif not quick:
                 error(errors_string.format("Broken headers", errors.get('header', 0)))
         else:
             log_ok("no issues found\n", level=Verb.WARN)
 
+    if stream:
+        log("\nreported to %s\n" % report_path, level=Verb.WARN)
+        report.close()
+
     if log_to_file:
         log("\nlogged to %s with verbosity %d\n" % (log_path, log_verbosity), level=Verb.WARN)
         logfile.close()
@@ -3,6 +3,7 @@
 # A Lot of Videos (ALOV) video comparer by HHL
 # compares top half of one video to bottom half of other
 # requirements: bash 4, ffmpeg
+# see alov_sanity_checker.py --render for detected dimensions and batch rendering
 
 argc=$#
 